@@ -1,5 +1,6 @@
 import streamlit as st
 import whisper 
+import numpy as np
 import os
 import tempfile
 
@@ -8,6 +9,162 @@ st.set_page_config(page_title="英语听力精听工具", layout="wide")
 st.title("🎧 英语听力精听 Web App（自动断句 + 自动字幕）")
 
 
+# -------- 断句参数 --------
+SENTENCE_END = ('.', '?', '!')
+CLAUSE_END = (',', ';', ':')
+
+
+# 基于能量的语音检测：按帧计算 RMS，返回每帧之前/之后最近的有声帧下标，便于 O(1) 查询
+def voice_activity(audio, sr=whisper.audio.SAMPLE_RATE, frame_ms=20, threshold_db=-35):
+    frame = int(sr * frame_ms / 1000)
+    n = len(audio) // frame
+    frames = audio[:n * frame].reshape(n, frame)
+    rms = np.sqrt(np.einsum('ij,ij->i', frames, frames) / frame)
+    ref = np.percentile(rms, 95) if n else 1.0
+    db = 20 * np.log10(np.maximum(rms, 1e-10) / max(ref, 1e-10))
+    idx = np.arange(n)
+    voiced = db >= threshold_db
+    prev_voiced = np.maximum.accumulate(np.where(voiced, idx, -1))
+    next_voiced = np.minimum.accumulate(np.where(voiced, idx, n)[::-1])[::-1]
+    return prev_voiced, next_voiced, frame / sr
+
+
+# 计算每两个相邻单词之间的停顿长度（秒）
+# Whisper 常把停顿并入相邻单词的时间戳，因此取前一词最后一个有声帧到后一词第一个有声帧的间隔
+def word_pauses(starts, ends, voice=None):
+    gaps = np.maximum(starts[1:] - ends[:-1], 0.0)
+    if voice is None:
+        return gaps
+    prev_voiced, next_voiced, frame_dur = voice
+    n = len(prev_voiced)
+    if n == 0:
+        return gaps
+    # 前一词范围 [starts[i], ends[i]) 内最后一个有声帧，没有则视为从词首开始静音
+    a_lo = np.clip((starts[:-1] / frame_dur).astype(int), 0, n - 1)
+    a_hi = np.clip(np.ceil(ends[:-1] / frame_dur).astype(int) - 1, a_lo, n - 1)
+    offset = np.maximum(prev_voiced[a_hi], a_lo - 1) + 1
+    # 后一词范围 [starts[i+1], ends[i+1]) 内第一个有声帧，没有则视为到词尾都是静音
+    b_lo = np.clip((starts[1:] / frame_dur).astype(int), 0, n - 1)
+    b_hi = np.clip(np.ceil(ends[1:] / frame_dur).astype(int), b_lo + 1, n)
+    onset = np.minimum(next_voiced[b_lo], b_hi)
+    silent_time = np.maximum(onset - offset, 0) * frame_dur
+    return np.maximum(gaps, silent_time)
+
+
+# 对一段连续的单词按标点、停顿和目标时长断句
+def chunk_words(words, voice=None, target=4.0, max_duration=8.0, min_pause=0.3):
+    if not words:
+        return []
+    starts = np.array([w["start"] for w in words], dtype=float)
+    ends = np.array([w["end"] for w in words], dtype=float)
+    pauses = np.append(word_pauses(starts, ends, voice), np.inf)
+
+    # 每个单词之后断开的得分：句末标点 2，从句标点 1，明显停顿各加 1
+    text = [w["word"].strip() for w in words]
+    scores = np.array([2 if t.endswith(SENTENCE_END) else 1 if t.endswith(CLAUSE_END) else 0 for t in text])
+    scores = scores + (pauses >= min_pause) + (pauses >= 2 * min_pause)
+    min_duration = target / 2
+
+    bounds = []
+    chunk_start = 0
+    best = None      # 不短于 min_duration 的得分最高位置
+    nearest = None   # 时长最接近 target 的位置
+    i = 0
+    while i < len(words):
+        duration = ends[i] - starts[chunk_start]
+        if duration > max_duration or (duration > target + min_duration and scores[i] >= 1):
+            # 超长（或明显超过目标时长）时退回到得分最高的位置断开；没有标点或停顿时断在最接近目标时长处
+            if best is not None and scores[best] > 0:
+                cut = best
+            elif nearest is not None:
+                cut = nearest
+            else:
+                cut = i
+        elif (duration >= min_duration and scores[i] >= 3) or (duration >= target and scores[i] >= 1):
+            cut = i
+        else:
+            if duration >= min_duration and (best is None or scores[i] >= scores[best]):
+                best = i
+            if nearest is None or abs(duration - target) <= abs(ends[nearest] - starts[chunk_start] - target):
+                nearest = i
+            i += 1
+            continue
+        bounds.append((chunk_start, cut))
+        chunk_start = cut + 1
+        best = None
+        nearest = None
+        i = cut + 1
+    if chunk_start < len(words):
+        bounds.append((chunk_start, len(words) - 1))
+
+    # 过短的尾句并入前一句
+    if len(bounds) > 1:
+        s0, e0 = bounds[-2]
+        s1, e1 = bounds[-1]
+        if ends[e1] - starts[s1] < min_duration and ends[e1] - starts[s0] <= max_duration:
+            bounds[-2:] = [(s0, e1)]
+
+    return [
+        {
+            "start": float(starts[a]),
+            "end": float(ends[b]),
+            "text": "".join(w["word"] for w in words[a:b + 1]).strip(),
+        }
+        for a, b in bounds
+    ]
+
+
+# 根据单词时间戳、标点和停顿重新断句，得到长度均匀的跟读单元
+def rechunk_segments(segments, audio=None, target=4.0, max_duration=8.0, min_pause=0.3):
+    voice = voice_activity(audio) if audio is not None and len(audio) else None
+    options = dict(voice=voice, target=target, max_duration=max_duration, min_pause=min_pause)
+
+    chunks = []
+    words = []
+    for seg in segments:
+        seg_words = [w for w in seg.get("words", []) if w["word"].strip()]
+        if seg_words:
+            words.extend(seg_words)
+            continue
+        # 没有单词时间戳的片段按原样保留
+        chunks.extend(chunk_words(words, **options))
+        words = []
+        if seg["text"].strip():
+            chunks.append({"start": seg["start"], "end": seg["end"], "text": seg["text"].strip()})
+    chunks.extend(chunk_words(words, **options))
+    return chunks
+
+
+# -------- Whisper --------
+@st.cache_resource
+def load_model(name="base"):
+    return whisper.load_model(name)
+
+
+# 识别结果按音频内容缓存，调整断句参数时只重新断句，不重新识别
+@st.cache_data(show_spinner=False)
+def transcribe(audio_bytes, word_timestamps):
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
+    temp_file.write(audio_bytes)
+    temp_file.close()
+    try:
+        # 只解码一次，识别与断句共用同一份采样
+        audio = whisper.load_audio(temp_file.name)
+    finally:
+        os.remove(temp_file.name)
+    result = load_model().transcribe(audio, word_timestamps=word_timestamps)
+    return result, audio
+
+
+# -------- Sidebar --------
+with st.sidebar:
+    st.header("✂️ 断句设置")
+    rechunk = st.checkbox("按停顿和标点重新断句", value=True)
+    target_duration = st.slider("目标句长（秒）", 2.0, 10.0, 4.0, 0.5)
+    max_duration = st.slider("最长句长（秒）", 4.0, 20.0, 8.0, 0.5)
+    min_pause = st.slider("停顿阈值（秒）", 0.1, 1.0, 0.3, 0.05)
+
+
 # -------- Upload --------
 uploaded = st.file_uploader(
     "上传音频文件（支持 mp3 / wav / m4a）",
@@ -16,19 +173,13 @@ uploaded = st.file_uploader(
 
 if uploaded:
 
-    # 保存临时文件
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-    temp_file.write(uploaded.read())
-    temp_file.close()
+    audio_bytes = uploaded.getvalue()
 
     st.success("音频上传成功！")
-    st.audio(temp_file.name)
+    st.audio(audio_bytes)
 
-    st.info("⏳ 正在识别音频，请稍等...（第一次会稍慢，之后会快很多）")
-
-    # -------- Whisper --------
-    model = whisper.load_model("base")
-    result = model.transcribe(temp_file.name)
+    with st.spinner("⏳ 正在识别音频，请稍等...（第一次会稍慢，之后会快很多）"):
+        result, audio = transcribe(audio_bytes, rechunk)
 
     st.subheader("📌 整体识别文本")
     st.write(result["text"])
@@ -36,6 +187,14 @@ if uploaded:
     st.subheader("📍 自动断句（逐句展示）")
 
     segments = result["segments"]
+    if rechunk:
+        segments = rechunk_segments(
+            segments,
+            audio,
+            target=target_duration,
+            max_duration=max(max_duration, target_duration),
+            min_pause=min_pause,
+        )
 
     for seg in segments:
         start = round(seg["start"], 2)
@@ -47,7 +206,5 @@ if uploaded:
             st.write(text)
             st.markdown("---")
 
-    os.remove(temp_file.name)
-
 else:
     st.info("请上传音频文件开始体验 😊")
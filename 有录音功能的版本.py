@@ -7,6 +7,15 @@ import io
 import base64
 import tempfile
 import os
+import sys
+import random
+import string
+import time
+import uuid
+import hashlib
+import threading
+import zipfile
+from collections import OrderedDict, Counter
 import docx
 import PyPDF2
 from io import BytesIO
@@ -56,8 +65,223 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# 内存预算（MB），可通过环境变量 SHADOWING_MEMORY_BUDGET_MB 配置
+MEMORY_BUDGET_MB = float(os.environ.get("SHADOWING_MEMORY_BUDGET_MB", "512"))
+
+# 估算对象占用的字节数（递归统计容器内容）
+def estimate_nbytes(obj, _seen=None):
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_nbytes(k, _seen) + estimate_nbytes(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_nbytes(item, _seen) for item in obj)
+    return size
+
+# 按内容生成缓存键，相同内容在不同会话之间共享同一份
+def content_key(prefix, data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return f"{prefix}:{hashlib.sha1(data).hexdigest()}"
+
+class SessionMemoryManager:
+    """跨会话共享的内存管理器
+
+    大对象（音频、原文、字幕列表）按内容哈希存放在共享缓存中，
+    各会话只保存缓存键；总占用超出预算时按 LRU 淘汰最久未活动、
+    且淘汰后确实能释放共享对象的会话。
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._blobs = {}                 # key -> (对象, 字节数)
+        self._refs = {}                  # key -> 引用该对象的会话集合
+        self._sessions = OrderedDict()   # session_id -> {'keys', 'private', 'last'}
+        self._detached = {}              # 已淘汰会话 -> 仍留在其 session_state 中的私有字节数
+        self.evicted_sessions = 0
+
+    def open_session(self, session_id):
+        with self._lock:
+            self._detached.pop(session_id, None)
+            self._sessions[session_id] = {'keys': set(), 'private': 0, 'last': time.time()}
+
+    def touch(self, session_id, private_nbytes=0):
+        """标记会话活跃；会话已被淘汰时返回 False"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            session['private'] = private_nbytes
+            session['last'] = time.time()
+            self._sessions.move_to_end(session_id)
+            self._evict()
+            return True
+
+    def get(self, key):
+        with self._lock:
+            entry = self._blobs.get(key)
+            return entry[0] if entry else None
+
+    def get_or_create(self, session_id, key, factory):
+        """返回共享对象，不存在时调用 factory 创建，并记录会话引用"""
+        with self._lock:
+            entry = self._blobs.get(key)
+        obj = entry[0] if entry else factory()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                # 会话已被淘汰：只返回对象，不在共享缓存中留下无人释放的引用
+                return obj
+            entry = self._blobs.setdefault(key, (obj, estimate_nbytes(obj)))
+            self._refs.setdefault(key, set()).add(session_id)
+            session['keys'].add(key)
+            self._sessions.move_to_end(session_id)
+            self._evict()
+        return entry[0]
+
+    def has_session(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    def release(self, session_id, key):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session['keys'].discard(key)
+            self._release(session_id, key)
+
+    def usage(self):
+        with self._lock:
+            shared = sum(nbytes for _, nbytes in self._blobs.values())
+            private = self._private_bytes()
+            return {
+                'sessions': len(self._sessions),
+                'blobs': len(self._blobs),
+                'shared_bytes': shared,
+                'private_bytes': private,
+                'total_bytes': shared + private,
+                'budget_bytes': self.budget_bytes,
+                'evicted_sessions': self.evicted_sessions,
+            }
+
+    def _release(self, session_id, key):
+        refs = self._refs.get(key)
+        if refs is None:
+            return
+        refs.discard(session_id)
+        if not refs:
+            del self._refs[key]
+            self._blobs.pop(key, None)
+
+    def _private_bytes(self):
+        # 淘汰只能释放共享对象，会话自己的小对象仍在其 session_state 中，继续计入
+        return sum(s['private'] for s in self._sessions.values()) + sum(self._detached.values())
+
+    def _total_bytes(self):
+        shared = sum(nbytes for _, nbytes in self._blobs.values())
+        return shared + self._private_bytes()
+
+    def _freeable_bytes(self, session_id, session):
+        # 只有该会话独占的共享对象会在淘汰时真正释放
+        return sum(self._blobs[key][1] for key in session['keys'] if self._refs.get(key) == {session_id})
+
+    def _evict(self):
+        # 最近活跃的会话在末尾，始终保留当前会话；淘汰后释放不了内存的会话跳过
+        while self._total_bytes() > self.budget_bytes:
+            candidates = list(self._sessions.items())[:-1]
+            victim = next((sid for sid, s in candidates if self._freeable_bytes(sid, s) > 0), None)
+            if victim is None:
+                break
+            session = self._sessions.pop(victim)
+            for key in session['keys']:
+                self._release(victim, key)
+            self._detached[victim] = session['private']
+            self.evicted_sessions += 1
+
+@st.cache_resource
+def get_memory_manager():
+    return SessionMemoryManager(int(MEMORY_BUDGET_MB * 1024 * 1024))
+
+memory = get_memory_manager()
+
+# 会话被淘汰后重新登记，并丢弃失效的缓存键
+def reset_evicted_session():
+    memory.open_session(st.session_state.session_id)
+    st.session_state.memory_refs = {}
+    st.session_state.audio_file = None
+    st.session_state.current_subtitle = 0
+    st.warning("⚠️ 会话长时间未使用，音频和字幕已被释放，请重新上传")
+
+# 将会话中的某个槽位绑定到共享对象
+def bind_shared(slot, key, factory):
+    # 本次运行期间可能已被其他会话挤出，先重新登记再记录引用
+    if not memory.has_session(st.session_state.session_id):
+        reset_evicted_session()
+    refs = st.session_state.memory_refs
+    old_key = refs.get(slot)
+    obj = memory.get_or_create(st.session_state.session_id, key, factory)
+    if old_key and old_key != key:
+        memory.release(st.session_state.session_id, old_key)
+    refs[slot] = key
+    return obj
+
+# 读取会话槽位对应的共享对象
+def lookup_shared(slot, default=None):
+    key = st.session_state.memory_refs.get(slot)
+    if key is None:
+        return default
+    obj = memory.get(key)
+    if obj is None:
+        # 会话持有的对象一定被引用着，取不到说明会话已被淘汰
+        if not memory.has_session(st.session_state.session_id):
+            reset_evicted_session()
+        else:
+            st.session_state.memory_refs.pop(slot, None)
+        return default
+    return obj
+
+def get_audio_bytes():
+    return lookup_shared('audio')
+
+def get_subtitle_text():
+    return lookup_shared('subtitle_text', "")
+
+def set_subtitle_text(text):
+    bind_shared('subtitle_text', content_key('text', text), lambda: text)
+
+def get_subtitles():
+    return lookup_shared('subtitles', [])
+
+# 字幕是否来自 SRT（带真实时间轴），纯文本字幕的时间是按行估算的
+def has_timed_subtitles():
+    return st.session_state.memory_refs.get('subtitles', '').startswith('srt:')
+
+def set_subtitles(key, factory):
+    bind_shared('subtitles', key, factory)
+
+# 纯文本同时保存原文和按行切分的字幕（同一文本只解析一次）
+def load_text_subtitles(text):
+    set_subtitle_text(text)
+    set_subtitles(content_key('subtitles', text), lambda: parse_plain_text_to_subtitles(text))
+
 # 初始化session state
 def init_session_state():
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+        memory.open_session(st.session_state.session_id)
+    if 'memory_refs' not in st.session_state:
+        st.session_state.memory_refs = {}
+    if 'uploader_version' not in st.session_state:
+        st.session_state.uploader_version = {'audio': 0, 'subtitle': 0}
     if 'audio_file' not in st.session_state:
         st.session_state.audio_file = None
     if 'current_time' not in st.session_state:
@@ -68,12 +292,17 @@ def init_session_state():
         st.session_state.playback_rate = 1.0
     if 'vocabulary' not in st.session_state:
         st.session_state.vocabulary = []
-    if 'subtitles' not in st.session_state:
-        st.session_state.subtitles = []
     if 'current_subtitle' not in st.session_state:
         st.session_state.current_subtitle = 0
-    if 'subtitle_text' not in st.session_state:
-        st.session_state.subtitle_text = ""
+
+    # 会话自身的小对象只计入占用，不进入共享缓存
+    private_nbytes = (
+        estimate_nbytes(st.session_state.vocabulary)
+        + estimate_nbytes(st.session_state.get('notes', []))
+        + estimate_nbytes(st.session_state.get('cloze'))
+    )
+    if not memory.touch(st.session_state.session_id, private_nbytes):
+        reset_evicted_session()
 
 init_session_state()
 
@@ -153,6 +382,137 @@ def parse_plain_text_to_subtitles(text_content, duration_per_line=5):
     
     return subtitles
 
+WORD_PUNCTUATION = string.punctuation + '“”‘’…'
+
+# 单词标准化：去掉首尾空白和标点并转小写
+def normalize_word(word):
+    return word.strip().strip(WORD_PUNCTUATION).lower()
+
+# 为每条字幕预先计算填空位置（单词下标），同一种子下结果固定
+def build_cloze_masks(subtitles, seed, strategy="按词频", vocabulary=(), ratio=0.3):
+    normalized = [[normalize_word(w) for w in sub['words']] for sub in subtitles]
+    freq = Counter(w for words in normalized for w in words)
+    vocab = {normalize_word(w) for w in vocabulary}
+    masks = []
+    for i, words in enumerate(normalized):
+        if strategy == "按生词本":
+            # 只挖掉生词本中的单词
+            mask = [j for j, w in enumerate(words) if w in vocab]
+        elif len(words) > 3:
+            # 优先挖掉全文中出现次数少的实词，同频时按种子随机
+            rng = random.Random(f"{seed}:{i}")
+            candidates = [j for j, w in enumerate(words) if len(w) > 3 and w.isalpha()]
+            k = max(1, round(len(candidates) * ratio)) if candidates else 0
+            ranked = sorted(candidates, key=lambda j: (freq[words[j]], rng.random()))
+            mask = sorted(ranked[:k])
+        else:
+            mask = []
+        masks.append(mask)
+    return masks
+
+# 获取当前字幕的填空位置，只在字幕、选词方式或生词本变化时重新计算
+def get_cloze_masks(strategy):
+    subtitles_key = st.session_state.memory_refs.get('subtitles')
+    vocabulary = tuple(sorted(st.session_state.vocabulary)) if strategy == "按生词本" else ()
+    cache_key = (subtitles_key, strategy, vocabulary)
+    cloze = st.session_state.get('cloze')
+    if cloze is None or cloze['key'] != cache_key:
+        seed = content_key('cloze', f"{st.session_state.session_id}:{subtitles_key}")
+        cloze = {
+            'key': cache_key,
+            'masks': build_cloze_masks(get_subtitles(), seed, strategy, vocabulary),
+        }
+        st.session_state.cloze = cloze
+    return cloze['masks']
+
+# 挖空单词本身，保留首尾标点
+def blank_word(word):
+    core = word.strip(WORD_PUNCTUATION)
+    if not core:
+        return word
+    lead = len(word) - len(word.lstrip(WORD_PUNCTUATION))
+    return word[:lead] + "_" * min(len(core), 8) + word[lead + len(core):]
+
+# 按填空位置生成显示文本
+def render_cloze(words, mask):
+    hidden = set(mask)
+    return ' '.join(blank_word(w) if j in hidden else w for j, w in enumerate(words))
+
+# 批量评分：responses 为 {(字幕下标, 单词下标): 用户答案}，返回每个空是否正确
+def grade_cloze(subtitles, responses):
+    return {
+        (i, j): normalize_word(answer) == normalize_word(subtitles[i]['words'][j])
+        for (i, j), answer in responses.items()
+    }
+
+# 解码音频为 float32 采样数组 (采样数, 声道数)，取值范围 [-1, 1]
+def decode_audio(data):
+    seg = AudioSegment.from_file(BytesIO(data))
+    samples = np.array(seg.get_array_of_samples(), dtype=np.float32).reshape(-1, seg.channels)
+    samples /= float(1 << (8 * seg.sample_width - 1))
+    return samples, seg.frame_rate
+
+# 生成跟读训练音频：每句重复 N 次，句后留出与句长成比例的跟读间隔
+def build_drill(samples, sr, subtitles, repeats=3, gap_factor=1.0, min_gap=1.0, tempo=1.0, lead_in=0.5):
+    clips = []
+    for sub in subtitles:
+        start = max(int(sub['start'] * sr), 0)
+        end = min(int(sub['end'] * sr), len(samples))
+        if end <= start:
+            continue
+        clip = samples[start:end]
+        if tempo != 1.0:
+            import librosa
+            clip = librosa.effects.time_stretch(np.ascontiguousarray(clip.T), rate=tempo).T
+        gap = int(max(min_gap, gap_factor * len(clip) / sr) * sr)
+        clips.append((clip, gap))
+
+    # 预先计算总长度，一次分配后按位置写入
+    offset = int(lead_in * sr)
+    total = offset + sum(repeats * (len(clip) + gap) for clip, gap in clips)
+    drill = np.zeros((total, samples.shape[1]), dtype=np.float32)
+    for clip, gap in clips:
+        for _ in range(repeats):
+            drill[offset:offset + len(clip)] = clip
+            offset += len(clip) + gap
+    return drill
+
+# 将采样数组编码为 MP3 / OGG
+def export_drill(drill, sr, fmt="mp3"):
+    pcm = (np.clip(drill, -1.0, 1.0) * 32767).astype(np.int16)
+    seg = AudioSegment(pcm.tobytes(), frame_rate=sr, sample_width=2, channels=drill.shape[1])
+    buffer = BytesIO()
+    if fmt == "ogg":
+        seg.export(buffer, format="ogg", codec="libvorbis")
+    else:
+        seg.export(buffer, format="mp3")
+    buffer.seek(0)
+    return buffer
+
+# 批量生成课程跟读音频，音频与 SRT 字幕按文件名配对，打包为 zip
+def build_course_drills(audio_files, subtitle_files, fmt="mp3", **drill_options):
+    # 只有 SRT 带有真实时间轴，纯文本的估算时间无法用来切分音频
+    subtitles_by_name = {}
+    for f in subtitle_files:
+        stem, ext = os.path.splitext(f.name)
+        if ext.lower() == '.srt':
+            subtitles_by_name[stem] = parse_srt(f.getvalue().decode('utf-8', errors='ignore'))
+
+    archive = BytesIO()
+    built, missing = [], []
+    with zipfile.ZipFile(archive, 'w') as zf:
+        for f in audio_files:
+            stem = os.path.splitext(f.name)[0]
+            if stem not in subtitles_by_name:
+                missing.append(f.name)
+                continue
+            samples, sr = decode_audio(f.getvalue())
+            drill = build_drill(samples, sr, subtitles_by_name[stem], **drill_options)
+            zf.writestr(f"{stem}_drill.{fmt}", export_drill(drill, sr, fmt).getvalue())
+            built.append(stem)
+    archive.seek(0)
+    return archive, built, missing
+
 # 侧边栏 - 简化的设置区域
 with st.sidebar:
     st.title("⚙️ 设置面板")
@@ -173,6 +533,13 @@ with st.sidebar:
         help="选择适合你的练习方式"
     )
     
+    # 填空选词方式
+    cloze_strategy = st.selectbox(
+        "填空选词",
+        ["按词频", "按生词本"],
+        help="按词频：优先隐藏低频词；按生词本：只隐藏生词本中的单词"
+    )
+    
     # 显示选项
     show_translation = st.checkbox("显示中文翻译", value=True)
     highlight_words = st.checkbox("高亮生词", value=True)
@@ -184,13 +551,25 @@ with st.sidebar:
     uploaded_audio = st.file_uploader(
         "选择音频文件",
         type=['mp3', 'wav', 'm4a', 'ogg'],
-        key="audio_uploader",
+        key=f"audio_uploader_{st.session_state.uploader_version['audio']}",
         help="支持 MP3, WAV, M4A, OGG 格式"
     )
     
     if uploaded_audio:
-        st.session_state.audio_file = uploaded_audio
-        st.success(f"✅ 已上传音频: {uploaded_audio.name}")
+        # 音频字节放入共享缓存，会话里只保留元信息
+        audio_bytes = uploaded_audio.getvalue()
+        bind_shared('audio', content_key('audio', audio_bytes), lambda: audio_bytes)
+        st.session_state.audio_file = {
+            'name': uploaded_audio.name,
+            'type': uploaded_audio.type,
+            'size': len(audio_bytes),
+        }
+        # 更换控件 key 清空上传控件，让共享缓存持有唯一一份音频
+        st.session_state.uploader_version['audio'] += 1
+        st.rerun()
+    
+    if st.session_state.audio_file:
+        st.success(f"✅ 已上传音频: {st.session_state.audio_file['name']}")
     
     st.divider()
     
@@ -203,7 +582,7 @@ with st.sidebar:
     uploaded_subtitle = st.file_uploader(
         "选择字幕文件",
         type=['srt', 'txt', 'doc', 'docx', 'pdf'],
-        key="subtitle_uploader",
+        key=f"subtitle_uploader_{st.session_state.uploader_version['subtitle']}",
         help="支持 SRT, TXT, DOC, DOCX, PDF 格式",
         label_visibility="collapsed"
     )
@@ -215,47 +594,47 @@ with st.sidebar:
             if file_extension == 'srt':
                 # 处理SRT文件
                 content = uploaded_subtitle.read().decode('utf-8', errors='ignore')
-                st.session_state.subtitles = parse_srt(content)
-                st.success(f"✅ 已加载 {len(st.session_state.subtitles)} 条SRT字幕")
+                set_subtitles(content_key('srt', content), lambda: parse_srt(content))
                 
             elif file_extension in ['doc', 'docx']:
                 # 处理Word文档
-                content = parse_docx(uploaded_subtitle)
-                st.session_state.subtitle_text = content
-                st.session_state.subtitles = parse_plain_text_to_subtitles(content)
-                st.success(f"✅ 已从Word文档提取 {len(st.session_state.subtitles)} 条字幕")
+                load_text_subtitles(parse_docx(uploaded_subtitle))
                 
             elif file_extension == 'pdf':
                 # 处理PDF文件
-                content = parse_pdf(uploaded_subtitle)
-                st.session_state.subtitle_text = content
-                st.session_state.subtitles = parse_plain_text_to_subtitles(content)
-                st.success(f"✅ 已从PDF文件提取 {len(st.session_state.subtitles)} 条字幕")
+                load_text_subtitles(parse_pdf(uploaded_subtitle))
                 
             elif file_extension == 'txt':
                 # 处理TXT文件
                 content = uploaded_subtitle.read().decode('utf-8', errors='ignore')
-                st.session_state.subtitle_text = content
-                st.session_state.subtitles = parse_plain_text_to_subtitles(content)
-                st.success(f"✅ 已从文本文件提取 {len(st.session_state.subtitles)} 条字幕")
+                load_text_subtitles(content)
             
-            # 显示文本预览
-            with st.expander("📄 查看原文内容"):
-                st.text_area("文本内容", 
-                           st.session_state.subtitle_text[:2000] + ("..." if len(st.session_state.subtitle_text) > 2000 else ""),
-                           height=200)
-                
+            st.session_state.subtitle_file = uploaded_subtitle.name
         except Exception as e:
             st.error(f"❌ 文件处理失败: {str(e)}")
+        else:
+            # 解析结果已进入共享缓存，清空上传控件释放原文件
+            st.session_state.uploader_version['subtitle'] += 1
+            st.rerun()
+    
+    if get_subtitles():
+        st.success(f"✅ 已从 {st.session_state.get('subtitle_file', '文本')} 加载 {len(get_subtitles())} 条字幕")
+    
+    if get_subtitle_text():
+        # 显示文本预览
+        with st.expander("📄 查看原文内容"):
+            st.text_area("文本内容", 
+                       get_subtitle_text()[:2000] + ("..." if len(get_subtitle_text()) > 2000 else ""),
+                       height=200)
     
     st.divider()
     
     # 字幕编辑区域
     st.subheader("✏️ 字幕编辑")
-    if st.session_state.subtitle_text:
+    if get_subtitle_text():
         edited_text = st.text_area(
             "编辑字幕文本",
-            value=st.session_state.subtitle_text,
+            value=get_subtitle_text(),
             height=150,
             help="每行将作为一条独立字幕"
         )
@@ -263,14 +642,13 @@ with st.sidebar:
         col1, col2 = st.columns(2)
         with col1:
             if st.button("💾 保存修改"):
-                st.session_state.subtitles = parse_plain_text_to_subtitles(edited_text)
-                st.session_state.subtitle_text = edited_text
+                load_text_subtitles(edited_text)
                 st.success("✅ 字幕已更新")
         with col2:
             if st.button("📥 下载字幕"):
                 # 创建SRT格式
                 srt_content = ""
-                for i, sub in enumerate(st.session_state.subtitles):
+                for i, sub in enumerate(get_subtitles()):
                     start_h = int(sub['start'] // 3600)
                     start_m = int((sub['start'] % 3600) // 60)
                     start_s = int(sub['start'] % 60)
@@ -291,12 +669,24 @@ with st.sidebar:
                     file_name="subtitles.srt",
                     mime="text/plain"
                 )
+    
+    st.divider()
+    
+    # 内存使用情况
+    with st.expander("💾 内存使用"):
+        usage = memory.usage()
+        st.progress(min(usage['total_bytes'] / usage['budget_bytes'], 1.0) if usage['budget_bytes'] else 0.0)
+        st.write(f"📦 总占用: {usage['total_bytes'] / 1024 / 1024:.1f} MB / {usage['budget_bytes'] / 1024 / 1024:.0f} MB")
+        st.write(f"🔗 共享缓存: {usage['shared_bytes'] / 1024 / 1024:.1f} MB（{usage['blobs']} 个对象）")
+        st.write(f"👤 会话私有: {usage['private_bytes'] / 1024:.1f} KB")
+        st.write(f"🧑‍🤝‍🧑 活跃会话: {usage['sessions']}，已淘汰: {usage['evicted_sessions']}")
 
 # 主界面
 st.title("🎧 英语听力练习播放器")
 
 # 音频播放器
-if st.session_state.audio_file:
+audio_bytes = get_audio_bytes() if st.session_state.audio_file else None
+if audio_bytes is not None:
     col1, col2, col3 = st.columns([1, 2, 1])
     
     with col1:
@@ -322,12 +712,12 @@ if st.session_state.audio_file:
             st.rerun()
     
     # 显示音频播放器
-    st.audio(st.session_state.audio_file, format=f"audio/{st.session_state.audio_file.type.split('/')[-1]}")
+    st.audio(audio_bytes, format=f"audio/{st.session_state.audio_file['type'].split('/')[-1]}")
     
     # 显示音频信息
     with st.expander("📊 音频信息"):
-        audio_size = len(st.session_state.audio_file.getvalue())
-        st.write(f"📁 文件名: {st.session_state.audio_file.name}")
+        audio_size = st.session_state.audio_file['size']
+        st.write(f"📁 文件名: {st.session_state.audio_file['name']}")
         st.write(f"📏 文件大小: {audio_size / 1024:.1f} KB")
         st.write(f"⚡ 播放速度: {st.session_state.playback_rate}x")
 else:
@@ -337,23 +727,26 @@ else:
 st.markdown("---")
 st.subheader("📝 字幕显示")
 
-if st.session_state.subtitles:
+if get_subtitles():
     # 统计信息
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("总字幕数", len(st.session_state.subtitles))
+        st.metric("总字幕数", len(get_subtitles()))
     with col2:
-        total_words = sum(len(sub['words']) for sub in st.session_state.subtitles)
+        total_words = sum(len(sub['words']) for sub in get_subtitles())
         st.metric("总单词数", total_words)
     with col3:
-        avg_words = total_words / len(st.session_state.subtitles) if st.session_state.subtitles else 0
+        avg_words = total_words / len(get_subtitles()) if get_subtitles() else 0
         st.metric("平均每句", f"{avg_words:.1f}词")
     
     # 创建字幕显示容器
     subtitle_container = st.container()
     
+    if practice_mode == "填空练习":
+        cloze_masks = get_cloze_masks(cloze_strategy)
+    
     with subtitle_container:
-        for i, subtitle in enumerate(st.session_state.subtitles):
+        for i, subtitle in enumerate(get_subtitles()):
             # 检查是否是当前播放的字幕
             is_current = (i == st.session_state.current_subtitle)
             
@@ -368,19 +761,8 @@ if st.session_state.subtitles:
                 
                 # 处理显示文本
                 if practice_mode == "填空练习":
-                    # 填空模式：每句话隐藏部分单词
-                    import random
-                    words = subtitle['words']
-                    if len(words) > 3:
-                        display_words = []
-                        for word in words:
-                            if random.random() < 0.3 and len(word) > 3:
-                                display_words.append("_" * min(len(word), 8))
-                            else:
-                                display_words.append(word)
-                        display_text = ' '.join(display_words)
-                    else:
-                        display_text = subtitle['text']
+                    # 填空模式：使用预先计算好的填空位置，重新运行时保持不变
+                    display_text = render_cloze(subtitle['words'], cloze_masks[i])
                 else:
                     display_text = subtitle['text']
                 
@@ -421,12 +803,12 @@ if st.session_state.subtitles:
                                             st.rerun()
     
     # 分页控制
-    if len(st.session_state.subtitles) > 20:
+    if len(get_subtitles()) > 20:
         st.markdown("---")
         st.write("📄 分页导航")
         
         page_size = 20
-        total_pages = (len(st.session_state.subtitles) + page_size - 1) // page_size
+        total_pages = (len(get_subtitles()) + page_size - 1) // page_size
         
         col1, col2, col3 = st.columns([1, 2, 1])
         with col1:
@@ -458,8 +840,8 @@ Let's practice some more sentences.
 The weather is nice today."""
         
         if st.button("使用示例文本"):
-            st.session_state.subtitle_text = sample_text
-            st.session_state.subtitles = parse_plain_text_to_subtitles(sample_text)
+            load_text_subtitles(sample_text)
+            st.session_state.subtitle_file = "示例文本"
             st.success("✅ 已加载示例文本")
             st.rerun()
 
@@ -467,7 +849,7 @@ The weather is nice today."""
 st.markdown("---")
 st.subheader("💪 学习工具")
 
-tab1, tab2, tab3, tab4 = st.tabs(["生词本", "笔记", "测试", "统计"])
+tab1, tab2, tab3, tab4, tab5 = st.tabs(["生词本", "笔记", "测试", "统计", "跟读音频"])
 
 with tab1:
     st.write("### 📒 我的生词本")
@@ -542,7 +924,7 @@ with tab2:
 with tab3:
     st.write("### 📝 听力测试")
     
-    if st.session_state.subtitles:
+    if get_subtitles():
         test_type = st.radio(
             "测试类型",
             ["听写练习", "填空测试", "理解测试"],
@@ -551,10 +933,8 @@ with tab3:
         
         if test_type == "听写练习":
             # 随机选择句子进行听写
-            import random
-            
             if 'test_sentence' not in st.session_state:
-                st.session_state.test_sentence = random.choice(st.session_state.subtitles)['text']
+                st.session_state.test_sentence = random.choice(get_subtitles())['text']
             
             st.write("**听写以下句子：**")
             st.write(f"> {st.session_state.test_sentence}")
@@ -572,11 +952,46 @@ with tab3:
             
             with col2:
                 if st.button("下一题"):
-                    st.session_state.test_sentence = random.choice(st.session_state.subtitles)['text']
+                    st.session_state.test_sentence = random.choice(get_subtitles())['text']
                     st.rerun()
         
         elif test_type == "填空测试":
-            st.info("生成填空测试功能开发中...")
+            subtitles = get_subtitles()
+            subtitles_key = st.session_state.memory_refs.get('subtitles')
+            masks = get_cloze_masks(cloze_strategy)
+            testable = [i for i, mask in enumerate(masks) if mask]
+            
+            if not testable:
+                if cloze_strategy == "按生词本":
+                    st.info("字幕中没有生词本里的单词，请先添加生词或切换为按词频选词")
+                else:
+                    st.info("字幕太短，无法生成填空题")
+            else:
+                page_size = 5
+                total_pages = (len(testable) + page_size - 1) // page_size
+                page = st.number_input("题组", min_value=1, max_value=total_pages, value=1, step=1, key=f"cloze_page_{subtitles_key}")
+                batch = testable[(page - 1) * page_size:page * page_size]
+                
+                with st.form("cloze_test"):
+                    responses = {}
+                    for n, i in enumerate(batch, (page - 1) * page_size + 1):
+                        st.write(f"**{n}.** {render_cloze(subtitles[i]['words'], masks[i])}")
+                        cols = st.columns(len(masks[i]))
+                        for k, (col, j) in enumerate(zip(cols, masks[i]), 1):
+                            with col:
+                                responses[(i, j)] = st.text_input(f"空 {k}", key=f"cloze_{subtitles_key}_{i}_{j}")
+                    submitted = st.form_submit_button("提交答案")
+                
+                if submitted:
+                    results = grade_cloze(subtitles, responses)
+                    correct = sum(results.values())
+                    st.metric("得分", f"{correct}/{len(results)}")
+                    if correct == len(results):
+                        st.success("🎉 全部正确！")
+                    else:
+                        for (i, j), ok in results.items():
+                            if not ok:
+                                st.write(f"❌ {responses[(i, j)] or '（未作答）'} → **{subtitles[i]['words'][j]}**")
         
         elif test_type == "理解测试":
             st.info("理解测试功能开发中...")
@@ -586,10 +1001,10 @@ with tab3:
 with tab4:
     st.write("### 📊 学习统计")
     
-    if st.session_state.subtitles:
+    if get_subtitles():
         # 计算统计数据
-        total_sentences = len(st.session_state.subtitles)
-        total_words = sum(len(sub['words']) for sub in st.session_state.subtitles)
+        total_sentences = len(get_subtitles())
+        total_words = sum(len(sub['words']) for sub in get_subtitles())
         avg_words = total_words / total_sentences if total_sentences > 0 else 0
         total_vocab = len(st.session_state.vocabulary)
         
@@ -607,9 +1022,8 @@ with tab4:
         # 单词频率分析
         st.write("### 📈 单词频率分析")
         if st.button("生成词频分析"):
-            from collections import Counter
             all_words = []
-            for sub in st.session_state.subtitles:
+            for sub in get_subtitles():
                 all_words.extend([word.lower() for word in sub['words'] if word.isalpha()])
             
             word_freq = Counter(all_words)
@@ -632,21 +1046,84 @@ with tab4:
     else:
         st.info("请先上传字幕文件查看统计")
 
+with tab5:
+    st.write("### 🔁 跟读训练音频")
+    st.caption("每句播放后留出跟读时间，可重复多遍并放慢语速")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        drill_repeats = st.slider("每句重复次数", min_value=1, max_value=5, value=3)
+        drill_gap = st.slider("跟读间隔（句长倍数）", min_value=0.5, max_value=3.0, value=1.2, step=0.1)
+    with col2:
+        drill_tempo = st.slider("语速", min_value=0.5, max_value=1.0, value=1.0, step=0.05)
+        drill_format = st.radio("导出格式", ["mp3", "ogg"], horizontal=True)
+    drill_options = dict(repeats=drill_repeats, gap_factor=drill_gap, tempo=drill_tempo)
+    
+    if audio_bytes is not None and get_subtitles() and has_timed_subtitles():
+        if st.button("🎼 生成跟读音频", type="primary"):
+            with st.spinner("正在生成跟读音频..."):
+                # 解码后的采样体积远大于压缩音频，只在生成时临时使用，不放入缓存
+                samples, sr = decode_audio(audio_bytes)
+                drill = build_drill(samples, sr, get_subtitles(), **drill_options)
+                del samples
+                drill_name = os.path.splitext(st.session_state.audio_file['name'])[0]
+                st.download_button(
+                    label=f"下载 {drill_format.upper()} 文件",
+                    data=export_drill(drill, sr, drill_format),
+                    file_name=f"{drill_name}_drill.{drill_format}",
+                    mime=f"audio/{'mpeg' if drill_format == 'mp3' else 'ogg'}"
+                )
+                st.success(f"✅ 已生成 {len(drill) / sr / 60:.1f} 分钟的跟读音频")
+    elif get_subtitles() and not has_timed_subtitles():
+        st.info("跟读音频需要带时间轴的 SRT 字幕，文本文件的时间是估算的，无法对齐音频")
+    else:
+        st.info("请先上传音频和 SRT 字幕文件")
+    
+    # 批量生成（教师用）
+    with st.expander("📦 批量生成课程跟读音频"):
+        st.caption("音频与字幕按文件名配对，例如 lesson1.mp3 与 lesson1.srt")
+        course_audio = st.file_uploader(
+            "课程音频",
+            type=['mp3', 'wav', 'm4a', 'ogg'],
+            accept_multiple_files=True,
+            key="course_audio_uploader"
+        )
+        course_subtitles = st.file_uploader(
+            "课程字幕（SRT）",
+            type=['srt'],
+            accept_multiple_files=True,
+            key="course_subtitle_uploader"
+        )
+        if course_audio and course_subtitles and st.button("📦 批量生成"):
+            with st.spinner(f"正在生成 {len(course_audio)} 个跟读音频..."):
+                archive, built, missing = build_course_drills(
+                    course_audio, course_subtitles, fmt=drill_format, **drill_options
+                )
+            if built:
+                st.download_button(
+                    label=f"下载全部（{len(built)} 个）",
+                    data=archive,
+                    file_name="course_drills.zip",
+                    mime="application/zip"
+                )
+            if missing:
+                st.warning(f"以下音频没有找到对应字幕: {', '.join(missing)}")
+
 # 响应式音频波形图
-if st.session_state.audio_file and st.session_state.subtitles:
+if st.session_state.audio_file and get_subtitles():
     st.markdown("---")
     st.subheader("📊 学习进度")
     
     # 创建简单的进度图
-    total_duration = max(sub['end'] for sub in st.session_state.subtitles) if st.session_state.subtitles else 0
+    total_duration = max(sub['end'] for sub in get_subtitles()) if get_subtitles() else 0
     
     # 计算学习进度
-    learned_count = min(st.session_state.current_subtitle + 1, len(st.session_state.subtitles))
-    progress_percent = (learned_count / len(st.session_state.subtitles)) * 100 if st.session_state.subtitles else 0
+    learned_count = min(st.session_state.current_subtitle + 1, len(get_subtitles()))
+    progress_percent = (learned_count / len(get_subtitles())) * 100 if get_subtitles() else 0
     
     # 显示进度条
     st.progress(progress_percent / 100)
-    st.write(f"**学习进度:** {learned_count}/{len(st.session_state.subtitles)} 句 ({progress_percent:.1f}%)")
+    st.write(f"**学习进度:** {learned_count}/{len(get_subtitles())} 句 ({progress_percent:.1f}%)")
 
 # 底部信息
 st.markdown("---")
@@ -662,7 +1139,7 @@ with st.expander("📦 安装说明"):
     st.write("""
     **依赖安装:**
     ```bash
-    pip install streamlit pandas numpy plotly pydub python-docx PyPDF2
+    pip install streamlit pandas numpy plotly pydub python-docx PyPDF2 librosa
     ```
     
     **运行应用:**